@@ -1,33 +1,316 @@
 from __future__ import annotations
 
+import multiprocessing
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from itertools import islice
 from pathlib import Path
-from typing import Any
+from typing import Any, Iterator
 
+import orjson
 from dotenv import load_dotenv
 from flask import Flask, jsonify, request
+from flask.json.provider import JSONProvider
 
 from config import load_settings
 from db import (
+    clear_query_cache,
     connect,
+    get_read_conn,
     init_db,
-    delete_document_chunks,
     get_document_by_path,
     insert_chunks,
-    insert_fts_rows,
     list_documents,
+    merge_fts,
     search_chunks,
+    update_document_mtime,
     upsert_document,
 )
-from indexer import index_pdf
-from utils import iter_pdf_paths
+from indexer import IndexedDocument, index_pdf
+from utils import iter_pdf_paths, quick_fingerprint
 
 load_dotenv()
 
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson (used by jsonify and get_json)."""
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s: str | bytes, **kwargs: Any) -> Any:
+        return orjson.loads(s)
+
+
 settings = load_settings()
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+
+# Single writer connection, used only by the ingest worker thread. It is
+# opened on first use rather than at import, so spawned extraction workers,
+# which re-import the main module, never open a writer or run init_db.
+# Read endpoints use a per-thread connection from get_read_conn().
+_writer_conn: sqlite3.Connection | None = None
+_writer_lock = threading.Lock()
+
+
+def get_writer_conn() -> sqlite3.Connection:
+    global _writer_conn
+    if _writer_conn is None:
+        with _writer_lock:
+            if _writer_conn is None:
+                conn = connect(settings.db_path, check_same_thread=False)
+                init_db(conn)
+                _writer_conn = conn
+    return _writer_conn
+
+
+@app.before_request
+def _ensure_db() -> None:
+    # Read endpoints need the schema even before the first ingest.
+    get_writer_conn()
+
+# Background ingest jobs. One worker thread matches SQLite's single writer,
+# so jobs run in submission order; each job still fans PDF extraction out
+# to the process pool.
+MAX_JOBS = 1000
+JOBS: dict[str, dict[str, Any]] = {}
+_jobs_lock = threading.Lock()
+_ingest_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest")
+
+
+# Extraction workers are forked where that is safe: fork starts fastest and
+# the children only run index_pdf, never touching the inherited SQLite
+# connection. Windows has no fork, and macOS can't fork a multi-threaded
+# process safely, so both use the platform default (spawn). Either way the
+# pool starts before the batch's BEGIN IMMEDIATE (see _index_pdfs_parallel).
+_MP_CONTEXT = multiprocessing.get_context(
+    "fork" if "fork" in multiprocessing.get_all_start_methods() and sys.platform != "darwin" else None
+)
+
+
+@contextmanager
+def _index_pdfs_parallel(
+    pdf_paths: list[Path],
+    window: int,
+) -> Iterator[Iterator[tuple[int, IndexedDocument | Exception]]]:
+    """
+    Extract and chunk PDFs in a worker process pool.
+
+    The pool starts and the first `window` files are submitted on entry, so
+    workers exist before the caller takes the write lock. The yielded
+    iterator produces (index into pdf_paths, document or error) as each file
+    finishes. At most `window` files are in flight, so extracted text for
+    the whole batch is never held in memory at once.
+    """
+    kwargs = {
+        "max_chunk_chars": settings.max_chunk_chars,
+        "min_chunk_chars": settings.min_chunk_chars,
+        "max_pages_per_chunk": settings.max_pages_per_chunk,
+    }
+    pending = deque(enumerate(pdf_paths))
+    futs: dict[Future[IndexedDocument], int] = {}
+    ex = ProcessPoolExecutor(max_workers=window, mp_context=_MP_CONTEXT)
+
+    def fill() -> bool:
+        # Top up the in-flight window; False if the pool turned out broken.
+        while pending and len(futs) < window:
+            i, p = pending[0]
+            try:
+                futs[ex.submit(index_pdf, p, **kwargs)] = i
+            except BrokenProcessPool:
+                return False
+            pending.popleft()
+        return True
+
+    def results() -> Iterator[tuple[int, IndexedDocument | Exception]]:
+        nonlocal ex
+        broken = False
+        while futs or pending:
+            if futs:
+                done, _ = wait(futs, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    i = futs.pop(fut)
+                    outcome: IndexedDocument | Exception
+                    try:
+                        outcome = fut.result()
+                    except BrokenProcessPool as e:
+                        outcome = e
+                        broken = True
+                    except Exception as e:
+                        outcome = e
+                    yield i, outcome
+
+            if broken and not futs:
+                # A worker died (e.g. MuPDF crashing on a malformed PDF), so
+                # every file in flight was reported as failed above. Carry on
+                # with the rest in a fresh pool; its workers start inside the
+                # transaction but, like the first ones, only run index_pdf.
+                ex.shutdown(wait=False)
+                ex = ProcessPoolExecutor(max_workers=window, mp_context=_MP_CONTEXT)
+                broken = False
+            if not broken:
+                broken = not fill()
+
+    fill()
+    try:
+        yield results()
+    finally:
+        ex.shutdown()
+
+
+def _run_ingest(pdf_paths: list[Path], *, force: bool) -> dict[str, Any]:
+    """Index pdf_paths into the database and return an ingest summary."""
+    indexed = 0
+    skipped = 0
+    errors: list[dict[str, str]] = []
+
+    writer_conn = get_writer_conn()
+
+    # Cheap change detection happens up front so unchanged files never reach
+    # a worker process.
+    to_index: list[tuple[Path, Path]] = []
+    touched: list[tuple[str, float]] = []
+    for pdf_path in pdf_paths:
+        try:
+            pdf_path_resolved = pdf_path.resolve()
+            existing = get_document_by_path(writer_conn, str(pdf_path_resolved))
+
+            # Two-stage change detection: mtime + size first (free), then a
+            # head+tail fingerprint before paying for a full sha256. Force
+            # skips both: it is the way to recover when the fingerprint misses
+            # a mid-file change, so it always re-hashes.
+            if existing and not force:
+                try:
+                    stat = pdf_path_resolved.stat()
+                    same_size = int(existing["size_bytes"]) == int(stat.st_size)
+                    if same_size and float(existing["mtime"]) == float(stat.st_mtime):
+                        skipped += 1
+                        continue
+
+                    if same_size and existing["fingerprint"] == quick_fingerprint(pdf_path_resolved):
+                        # Touched or copied but unchanged: just record the new mtime.
+                        touched.append((str(existing["id"]), float(stat.st_mtime)))
+                        skipped += 1
+                        continue
+                except Exception:
+                    # If stat fails, just reindex
+                    pass
+
+            to_index.append((pdf_path, pdf_path_resolved))
+        except Exception as e:
+            errors.append({"file": str(pdf_path), "error": str(e)})
+
+    # The whole batch runs in one transaction so we pay for a single commit.
+    # Each file's document row and chunks (one executemany) are written inside
+    # a savepoint; chunks_fts is kept in sync by triggers.
+    cur = writer_conn.cursor()
+
+    # Extraction runs in worker processes; all SQLite writes stay here. The
+    # pool and its first submissions come before BEGIN IMMEDIATE.
+    window = max(1, min(settings.ingest_workers, len(to_index)))
+    with _index_pdfs_parallel([p for _, p in to_index], window) as results:
+        cur.execute("BEGIN IMMEDIATE;")
+        try:
+            for doc_id, mtime in touched:
+                update_document_mtime(cur, doc_id, mtime)
+
+            for i, outcome in results:
+                pdf_path = to_index[i][0]
+                if isinstance(outcome, Exception):
+                    errors.append({"file": str(pdf_path), "error": str(outcome)})
+                    continue
+                doc = outcome
+
+                # Savepoints are released before the next file, so one fixed name
+                # works and keeps these statements in the statement cache.
+                cur.execute("SAVEPOINT sp_doc;")
+                try:
+                    # Replaces any existing row for this path (or content); its
+                    # chunks go with it via ON DELETE CASCADE.
+                    upsert_document(
+                        cur,
+                        doc_id=doc.doc_id,
+                        path=doc.path,
+                        filename=doc.filename,
+                        sha256=doc.sha256,
+                        fingerprint=doc.fingerprint,
+                        mtime=doc.mtime,
+                        size_bytes=doc.size_bytes,
+                        indexed_at=doc.indexed_at,
+                    )
+                    insert_chunks(
+                        cur,
+                        [(c.id, c.doc_id, c.page_start, c.page_end, c.text) for c in doc.chunks],
+                    )
+                    cur.execute("RELEASE sp_doc;")
+                    indexed += 1
+                except Exception as e:
+                    # Undo only this file's writes; the rest of the batch survives.
+                    cur.execute("ROLLBACK TO sp_doc;")
+                    cur.execute("RELEASE sp_doc;")
+                    errors.append({"file": str(pdf_path), "error": str(e)})
+
+            if indexed:
+                merge_fts(writer_conn)
+            writer_conn.commit()
+        except Exception:
+            writer_conn.rollback()
+            raise
+        finally:
+            clear_query_cache()
+
+    return {
+        "indexed": indexed,
+        "skipped": skipped,
+        "errors": errors,
+        "db_path": str(settings.db_path),
+    }
+
+
+def _collect_pdf_paths(input_dir: str | None, files: list[str] | None, recursive: bool) -> list[Path]:
+    pdf_paths: list[Path] = []
+
+    if files:
+        for f in files:
+            p = Path(f)
+            if p.exists() and p.is_file() and p.suffix.lower() == ".pdf":
+                pdf_paths.append(p)
+    else:
+        base = Path(input_dir) if input_dir else settings.default_docs_dir
+        pdf_paths.extend(list(iter_pdf_paths(base, recursive=recursive)))
+
+    return pdf_paths
+
 
-conn = connect(settings.db_path)
-init_db(conn)
+def _update_job(job_id: str, **fields: Any) -> None:
+    with _jobs_lock:
+        JOBS[job_id].update(fields)
+
+
+def _run_ingest_job(
+    job_id: str,
+    input_dir: str | None,
+    files: list[str] | None,
+    recursive: bool,
+    force: bool,
+) -> None:
+    """Executor entry point: run one ingest and record the outcome on the job."""
+    _update_job(job_id, status="running", started_at=time.time())
+    try:
+        pdf_paths = _collect_pdf_paths(input_dir, files, recursive)
+        summary = _run_ingest(pdf_paths, force=force)
+    except Exception as e:
+        _update_job(job_id, status="failed", error=str(e), finished_at=time.time())
+        return
+    _update_job(job_id, status="done", finished_at=time.time(), **summary)
 
 
 @app.get("/")
@@ -40,7 +323,8 @@ def root() -> Any:
             "endpoints": {
                 "GET /health": "Health check endpoint",
                 "GET /docs": "List indexed documents (query param: limit)",
-                "POST /ingest": "Ingest PDF files for indexing",
+                "POST /ingest": "Queue PDF files for indexing (returns a job_id)",
+                "GET /ingest/<job_id>": "Ingest job status and summary",
                 "POST /query": "Search the indexed documents",
             },
         }
@@ -55,13 +339,14 @@ def health() -> Any:
 @app.get("/docs")
 def docs() -> Any:
     limit = int(request.args.get("limit", 200))
-    return jsonify({"documents": list_documents(conn, limit=limit)})
+    return jsonify({"documents": list_documents(get_read_conn(settings.db_path), limit=limit)})
 
 
 @app.post("/ingest")
 def ingest() -> Any:
     """
-    Ingest PDFs.
+    Queue a background ingest of PDFs. Returns 202 with a job_id; poll
+    GET /ingest/<job_id> for status and the summary.
 
     JSON body options:
     {
@@ -77,81 +362,33 @@ def ingest() -> Any:
     recursive = bool(body.get("recursive", True))
     force = bool(body.get("force", False))
 
-    pdf_paths: list[Path] = []
-
-    if files:
-        for f in files:
-            p = Path(f)
-            if p.exists() and p.is_file() and p.suffix.lower() == ".pdf":
-                pdf_paths.append(p)
-    else:
-        base = Path(input_dir) if input_dir else settings.default_docs_dir
-        pdf_paths.extend(list(iter_pdf_paths(base, recursive=recursive)))
-
-    indexed = 0
-    skipped = 0
-    errors: list[dict[str, str]] = []
-
-    for pdf_path in pdf_paths:
-        try:
-            pdf_path_resolved = pdf_path.resolve()
-            existing = get_document_by_path(conn, str(pdf_path_resolved))
-
-            # Cheap change detection: mtime + size, and optionally sha.
-            # We still compute sha during indexing; this check avoids work.
-            if existing and not force:
-                try:
-                    stat = pdf_path_resolved.stat()
-                    if float(existing["mtime"]) == float(stat.st_mtime) and int(existing["size_bytes"]) == int(stat.st_size):
-                        skipped += 1
-                        continue
-                except Exception:
-                    # If stat fails, just reindex
-                    pass
+    job_id = uuid.uuid4().hex
+    with _jobs_lock:
+        JOBS[job_id] = {
+            "job_id": job_id,
+            "status": "pending",
+            "submitted_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+        }
+        # Forget the oldest finished jobs once we hold too many.
+        for old_id in [k for k, j in JOBS.items() if j["status"] in ("done", "failed")]:
+            if len(JOBS) <= MAX_JOBS:
+                break
+            del JOBS[old_id]
 
-            doc = index_pdf(
-                pdf_path_resolved,
-                max_chunk_chars=settings.max_chunk_chars,
-                min_chunk_chars=settings.min_chunk_chars,
-                max_pages_per_chunk=settings.max_pages_per_chunk,
-            )
-
-            # Replace existing doc entries with same path (and its chunks)
-            if existing:
-                delete_document_chunks(conn, str(existing["id"]))
-
-            upsert_document(
-                conn,
-                doc_id=doc.doc_id,
-                path=doc.path,
-                filename=doc.filename,
-                sha256=doc.sha256,
-                mtime=doc.mtime,
-                size_bytes=doc.size_bytes,
-                indexed_at=doc.indexed_at,
-            )
-
-            chunk_rows = [(c.id, c.doc_id, c.page_start, c.page_end, c.text) for c in doc.chunks]
-            insert_chunks(conn, chunk_rows)
-
-            fts_rows = [(c.id, c.doc_id, doc.filename, doc.path, c.page_start, c.page_end, c.text) for c in doc.chunks]
-            insert_fts_rows(conn, fts_rows)
-
-            conn.commit()
-            indexed += 1
+    _ingest_executor.submit(_run_ingest_job, job_id, input_dir, files, recursive, force)
+    return jsonify({"job_id": job_id, "status": "pending"}), 202, {"Location": f"/ingest/{job_id}"}
 
-        except Exception as e:
-            conn.rollback()
-            errors.append({"file": str(pdf_path), "error": str(e)})
 
-    return jsonify(
-        {
-            "indexed": indexed,
-            "skipped": skipped,
-            "errors": errors,
-            "db_path": str(settings.db_path),
-        }
-    )
+@app.get("/ingest/<job_id>")
+def ingest_status(job_id: str) -> Any:
+    with _jobs_lock:
+        job = JOBS.get(job_id)
+        job = dict(job) if job else None
+    if job is None:
+        return jsonify({"error": "Unknown job_id"}), 404
+    return jsonify(job)
 
 
 @app.post("/query")
@@ -174,7 +411,7 @@ def query() -> Any:
     top_k = int(body.get("top_k") or settings.default_top_k)
     snippet_chars = int(body.get("snippet_chars") or settings.default_snippet_chars)
 
-    results = search_chunks(conn, q, top_k=top_k, snippet_chars=snippet_chars)
+    results = search_chunks(get_read_conn(settings.db_path), q, top_k=top_k, snippet_chars=snippet_chars)
 
     payload = []
     for r in results:
@@ -196,4 +433,5 @@ def query() -> Any:
 
 if __name__ == "__main__":
     # Dev server only. In production use gunicorn.
+    get_writer_conn()
     app.run(host=settings.flask_host, port=settings.flask_port, debug=True)
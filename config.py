@@ -23,6 +23,7 @@ class Settings:
     max_chunk_chars: int
     min_chunk_chars: int
     max_pages_per_chunk: int
+    ingest_workers: int
 
     default_top_k: int
     default_snippet_chars: int
@@ -41,6 +42,7 @@ def load_settings() -> Settings:
         max_chunk_chars=_env_int("RAG_MAX_CHUNK_CHARS", 8000),
         min_chunk_chars=_env_int("RAG_MIN_CHUNK_CHARS", 1200),
         max_pages_per_chunk=_env_int("RAG_MAX_PAGES_PER_CHUNK", 3),
+        ingest_workers=_env_int("RAG_INGEST_WORKERS", os.cpu_count() or 1),
         default_top_k=_env_int("RAG_DEFAULT_TOP_K", 5),
         default_snippet_chars=_env_int("RAG_DEFAULT_SNIPPET_CHARS", 800),
         flask_host=os.getenv("FLASK_HOST", "127.0.0.1"),
@@ -1,6 +1,8 @@
 from __future__ import annotations
 
 import sqlite3
+import threading
+from collections import OrderedDict
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Any, Iterable
@@ -17,13 +19,77 @@ class SearchResult:
     snippet: str
 
 
-def connect(db_path: Path) -> sqlite3.Connection:
+_local = threading.local()
+
+# In-process LRU of search results. Keys include _db_version, which every
+# write helper bumps, so writes invalidate cached results naturally. Commits
+# from other processes are caught by get_read_conn via PRAGMA data_version.
+QUERY_CACHE_SIZE = 1024
+_query_cache: OrderedDict[tuple[int, str, int, int], list[SearchResult]] = OrderedDict()
+_query_cache_lock = threading.Lock()
+_db_version = 0
+
+
+def _bump_db_version() -> None:
+    global _db_version
+    with _query_cache_lock:
+        _db_version += 1
+
+
+def clear_query_cache() -> None:
+    # Call after committing writes: results cached between a write and its
+    # commit would otherwise survive under the new version.
+    global _db_version
+    with _query_cache_lock:
+        _db_version += 1
+        _query_cache.clear()
+
+
+def connect(db_path: Path, *, check_same_thread: bool = True) -> sqlite3.Connection:
     db_path.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(str(db_path))
+    # Ingest re-runs the same few statements per file; a bigger statement
+    # cache keeps them all prepared. Pass check_same_thread=False for a
+    # connection opened on one thread and used on another (the writer).
+    conn = sqlite3.connect(str(db_path), cached_statements=256, check_same_thread=check_same_thread)
     conn.row_factory = sqlite3.Row
+    # 8 KiB pages suit multi-KB chunk text. Page size is fixed once the
+    # database has content or is in WAL mode, so only set it on a new file.
+    if conn.execute("PRAGMA page_count;").fetchone()[0] == 0:
+        conn.execute("PRAGMA page_size=8192;")
     conn.execute("PRAGMA journal_mode=WAL;")
     conn.execute("PRAGMA synchronous=NORMAL;")
     conn.execute("PRAGMA temp_store=MEMORY;")
+    # Wait for a busy writer instead of failing immediately.
+    conn.execute("PRAGMA busy_timeout=30000;")
+    # Checkpoint less often so a bulk ingest isn't synced mid-batch.
+    conn.execute("PRAGMA wal_autocheckpoint=10000;")
+    # Replacing a document row cascades to its chunks (and, via triggers, FTS).
+    conn.execute("PRAGMA foreign_keys=ON;")
+    # Larger page cache (128 MiB) and memory-mapped reads (up to 1 GiB).
+    conn.execute("PRAGMA cache_size=-131072;")
+    conn.execute("PRAGMA mmap_size=1073741824;")
+    return conn
+
+
+def get_read_conn(db_path: Path) -> sqlite3.Connection:
+    # One read-only connection per thread. Under WAL readers don't block each
+    # other or the writer, so /query and /docs run concurrently with ingest.
+    conns: dict[str, sqlite3.Connection] = _local.__dict__.setdefault("conns", {})
+    data_versions: dict[str, int] = _local.__dict__.setdefault("data_versions", {})
+    key = str(db_path)
+    conn = conns.get(key)
+    if conn is None:
+        conn = connect(db_path)
+        conn.execute("PRAGMA query_only=1;")
+        conns[key] = conn
+
+    # data_version changes whenever another connection commits, including one
+    # in another process (e.g. a different gunicorn worker running an ingest),
+    # so drop cached search results once this connection sees it move.
+    data_version = conn.execute("PRAGMA data_version;").fetchone()[0]
+    if data_versions.get(key, data_version) != data_version:
+        clear_query_cache()
+    data_versions[key] = data_version
     return conn
 
 
@@ -35,272 +101,182 @@ def init_db(conn: sqlite3.Connection) -> None:
             path TEXT NOT NULL,
             filename TEXT NOT NULL,
             sha256 TEXT NOT NULL,
+            fingerprint TEXT,
             mtime REAL NOT NULL,
             size_bytes INTEGER NOT NULL,
             indexed_at REAL NOT NULL
         );
         """
     )
+
+    # Rebuild chunks for databases created before chunks_fts became an
+    # external-content table (no stable integer rowid on chunks) or before
+    # chunks cascaded on document deletion.
+    chunk_cols = {r["name"] for r in conn.execute("PRAGMA table_info(chunks);")}
+    chunk_fks = conn.execute("PRAGMA foreign_key_list(chunks);").fetchall()
+    migrate_chunks = bool(chunk_cols) and (
+        "id_rowid" not in chunk_cols or any(fk["on_delete"] != "CASCADE" for fk in chunk_fks)
+    )
+    if migrate_chunks:
+        conn.execute("DROP TABLE IF EXISTS chunks_fts;")
+        for trigger in ("chunks_ai", "chunks_ad", "chunks_au"):
+            conn.execute(f"DROP TRIGGER IF EXISTS {trigger};")
+        conn.execute("DROP INDEX IF EXISTS idx_chunks_doc;")
+        conn.execute("ALTER TABLE chunks RENAME TO chunks_old;")
+
+    # id_rowid aliases the rowid so it survives VACUUM; chunks_fts points at it.
     conn.execute(
         """
         CREATE TABLE IF NOT EXISTS chunks (
-            id TEXT PRIMARY KEY,
+            id_rowid INTEGER PRIMARY KEY,
+            id TEXT NOT NULL UNIQUE,
             document_id TEXT NOT NULL,
             page_start INTEGER NOT NULL,
             page_end INTEGER NOT NULL,
             text TEXT NOT NULL,
-            FOREIGN KEY (document_id) REFERENCES documents(id)
+            FOREIGN KEY (document_id) REFERENCES documents(id) ON DELETE CASCADE
         );
         """
     )
 
-    # FTS5 for chunks.text; store chunk_id + doc_id + pages as UNINDEXED metadata.
+    fts_exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chunks_fts';"
+    ).fetchone()
+
+    # FTS5 over chunks.text only. The text itself lives in chunks (external
+    # content); metadata is joined back from chunks/documents at query time.
+    # Text is indexed as-is: unicode61 already case-folds and treats
+    # punctuation as a separator. Stripping punctuation beforehand would merge
+    # tokens ("log-rotate" -> "logrotate") and break phrase/term matches.
     conn.execute(
         """
         CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
-            chunk_id UNINDEXED,
-            document_id UNINDEXED,
-            filename UNINDEXED,
-            path UNINDEXED,
-            page_start UNINDEXED,
-            page_end UNINDEXED,
             text,
+            content = 'chunks',
+            content_rowid = 'id_rowid',
             tokenize = 'unicode61'
         );
         """
     )
 
-    # Helpful indexes
-    conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_doc ON chunks(document_id);")
-    conn.commit()
-
+    if not fts_exists:
+        # Bigger leaf pages, and no incremental merging on every insert:
+        # ingest merges once per batch instead (see merge_fts).
+        conn.execute("INSERT INTO chunks_fts (chunks_fts, rank) VALUES ('pgsz', 4096);")
+        conn.execute("INSERT INTO chunks_fts (chunks_fts, rank) VALUES ('automerge', 0);")
 
-def upsert_document(
-    conn: sqlite3.Connection,
-    *,
-    doc_id: str,
-    path: str,
-    filename: str,
-    sha256: str,
-    mtime: float,
-    size_bytes: int,
-    indexed_at: float,
-) -> None:
+    # Keep chunks_fts in sync with chunks.
     conn.execute(
         """
-        INSERT INTO documents (id, path, filename, sha256, mtime, size_bytes, indexed_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        ON CONFLICT(id) DO UPDATE SET
-            path=excluded.path,
-            filename=excluded.filename,
-            sha256=excluded.sha256,
-            mtime=excluded.mtime,
-            size_bytes=excluded.size_bytes,
-            indexed_at=excluded.indexed_at;
-        """,
-        (doc_id, path, filename, sha256, mtime, size_bytes, indexed_at),
-    )
-
-
-def get_document_by_path(conn: sqlite3.Connection, path: str) -> dict[str, Any] | None:
-    row = conn.execute(
-        "SELECT * FROM documents WHERE path = ? LIMIT 1;",
-        (path,),
-    ).fetchone()
-    return dict(row) if row else None
-
-
-def delete_document_chunks(conn: sqlite3.Connection, doc_id: str) -> None:
-    # Remove from chunks and FTS
-    conn.execute("DELETE FROM chunks WHERE document_id = ?;", (doc_id,))
-    conn.execute("DELETE FROM chunks_fts WHERE document_id = ?;", (doc_id,))
-
-
-def insert_chunks(
-    conn: sqlite3.Connection,
-    chunk_rows: Iterable[tuple[str, str, int, int, str]],
-) -> None:
-    conn.executemany(
-        """
-        INSERT INTO chunks (id, document_id, page_start, page_end, text)
-        VALUES (?, ?, ?, ?, ?);
-        """,
-        chunk_rows,
-    )
-
-
-def insert_fts_rows(
-    conn: sqlite3.Connection,
-    fts_rows: Iterable[tuple[str, str, str, str, int, int, str]],
-) -> None:
-    conn.executemany(
+        CREATE TRIGGER IF NOT EXISTS chunks_ai AFTER INSERT ON chunks BEGIN
+            INSERT INTO chunks_fts (rowid, text) VALUES (new.id_rowid, new.text);
+        END;
         """
-        INSERT INTO chunks_fts (chunk_id, document_id, filename, path, page_start, page_end, text)
-        VALUES (?, ?, ?, ?, ?, ?, ?);
-        """,
-        fts_rows,
     )
-
-
-def list_documents(conn: sqlite3.Connection, limit: int = 200) -> list[dict[str, Any]]:
-    rows = conn.execute(
-        """
-        SELECT id, filename, path, sha256, mtime, size_bytes, indexed_at
-        FROM documents
-        ORDER BY indexed_at DESC
-        LIMIT ?;
-        """,
-        (limit,),
-    ).fetchall()
-    return [dict(r) for r in rows]
-
-
-def search_chunks(
-    conn: sqlite3.Connection,
-    query: str,
-    top_k: int,
-    snippet_chars: int,
-) -> list[SearchResult]:
-    # Use bm25() ranking from FTS5.
-    # We also generate a snippet using snippet() function for readability.
-    rows = conn.execute(
-        """
-        SELECT
-            document_id,
-            filename,
-            path,
-            page_start,
-            page_end,
-            bm25(chunks_fts) AS score,
-            snippet(chunks_fts, 6, '[', ']', '…', ?) AS snippet
-        FROM chunks_fts
-        WHERE chunks_fts MATCH ?
-        ORDER BY score
-        LIMIT ?;
-        """,
-        (max(10, snippet_chars), query, top_k),
-    ).fetchall()
-
-    results: list[SearchResult] = []
-    for r in rows:
-        # In FTS5, lower bm25 score is better.
-        results.append(
-            SearchResult(
-                doc_id=str(r["document_id"]),
-                filename=str(r["filename"]),
-                path=str(r["path"]),
-                page_start=int(r["page_start"]),
-                page_end=int(r["page_end"]),
-                score=float(r["score"]),
-                snippet=str(r["snippet"]),
-            )
-        )
-    return results
-from __future__ import annotations
-
-import sqlite3
-from dataclasses import dataclass
-from pathlib import Path
-from typing import Any, Iterable
-
-
-@dataclass(frozen=True)
-class SearchResult:
-    doc_id: str
-    filename: str
-    path: str
-    page_start: int
-    page_end: int
-    score: float
-    snippet: str
-
-
-def connect(db_path: Path) -> sqlite3.Connection:
-    db_path.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(str(db_path))
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA journal_mode=WAL;")
-    conn.execute("PRAGMA synchronous=NORMAL;")
-    conn.execute("PRAGMA temp_store=MEMORY;")
-    return conn
-
-
-def init_db(conn: sqlite3.Connection) -> None:
     conn.execute(
         """
-        CREATE TABLE IF NOT EXISTS documents (
-            id TEXT PRIMARY KEY,
-            path TEXT NOT NULL,
-            filename TEXT NOT NULL,
-            sha256 TEXT NOT NULL,
-            mtime REAL NOT NULL,
-            size_bytes INTEGER NOT NULL,
-            indexed_at REAL NOT NULL
-        );
+        CREATE TRIGGER IF NOT EXISTS chunks_ad AFTER DELETE ON chunks BEGIN
+            INSERT INTO chunks_fts (chunks_fts, rowid, text) VALUES ('delete', old.id_rowid, old.text);
+        END;
         """
     )
     conn.execute(
         """
-        CREATE TABLE IF NOT EXISTS chunks (
-            id TEXT PRIMARY KEY,
-            document_id TEXT NOT NULL,
-            page_start INTEGER NOT NULL,
-            page_end INTEGER NOT NULL,
-            text TEXT NOT NULL,
-            FOREIGN KEY (document_id) REFERENCES documents(id)
-        );
+        CREATE TRIGGER IF NOT EXISTS chunks_au AFTER UPDATE ON chunks BEGIN
+            INSERT INTO chunks_fts (chunks_fts, rowid, text) VALUES ('delete', old.id_rowid, old.text);
+            INSERT INTO chunks_fts (rowid, text) VALUES (new.id_rowid, new.text);
+        END;
         """
     )
 
-    # FTS5 for chunks.text; store chunk_id + doc_id + pages as UNINDEXED metadata.
-    conn.execute(
-        """
-        CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
-            chunk_id UNINDEXED,
-            document_id UNINDEXED,
-            filename UNINDEXED,
-            path UNINDEXED,
-            page_start UNINDEXED,
-            page_end UNINDEXED,
-            text,
-            tokenize = 'unicode61'
-        );
-        """
-    )
+    if migrate_chunks:
+        conn.execute(
+            """
+            INSERT INTO chunks (id, document_id, page_start, page_end, text)
+            SELECT id, document_id, page_start, page_end, text FROM chunks_old
+            WHERE document_id IN (SELECT id FROM documents);
+            """
+        )
+        conn.execute("DROP TABLE chunks_old;")
+
+    # Databases created before the fingerprint column existed.
+    cols = {r["name"] for r in conn.execute("PRAGMA table_info(documents);")}
+    if "fingerprint" not in cols:
+        conn.execute("ALTER TABLE documents ADD COLUMN fingerprint TEXT;")
+
+    # One document row per path, so a changed file replaces its old row.
+    # Older databases may hold stale rows for a path; keep the newest.
+    has_path_index = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_documents_path';"
+    ).fetchone()
+    if not has_path_index:
+        conn.execute(
+            """
+            DELETE FROM documents
+            WHERE EXISTS (
+                SELECT 1 FROM documents newer
+                WHERE newer.path = documents.path
+                  AND (newer.indexed_at, newer.rowid) > (documents.indexed_at, documents.rowid)
+            );
+            """
+        )
+        conn.execute("CREATE UNIQUE INDEX idx_documents_path ON documents(path);")
 
     # Helpful indexes
     conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_doc ON chunks(document_id);")
     conn.commit()
 
+    if migrate_chunks:
+        # The old chunks/chunks_fts tables (text and UNINDEXED metadata stored
+        # twice) leave free pages behind; reclaim them once.
+        conn.execute("VACUUM;")
+
+
+# REPLACE removes any row with the same id or path; ON DELETE CASCADE then
+# drops its chunks, and the chunks_ad trigger their FTS entries.
+_UPSERT_DOCUMENT_SQL = """
+INSERT OR REPLACE INTO documents (id, path, filename, sha256, fingerprint, mtime, size_bytes, indexed_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?);
+"""
+
+# Chunk IDs are deterministic, so re-inserting a chunk updates it in place.
+# (An upsert, not INSERT OR REPLACE: REPLACE deletes don't fire chunks_ad.)
+_INSERT_CHUNK_SQL = """
+INSERT INTO chunks (id, document_id, page_start, page_end, text)
+VALUES (?, ?, ?, ?, ?)
+ON CONFLICT(id) DO UPDATE SET
+    document_id=excluded.document_id,
+    page_start=excluded.page_start,
+    page_end=excluded.page_end,
+    text=excluded.text;
+"""
+
 
 def upsert_document(
-    conn: sqlite3.Connection,
+    conn: sqlite3.Connection | sqlite3.Cursor,
     *,
     doc_id: str,
     path: str,
     filename: str,
     sha256: str,
+    fingerprint: str,
     mtime: float,
     size_bytes: int,
     indexed_at: float,
 ) -> None:
     conn.execute(
-        """
-        INSERT INTO documents (id, path, filename, sha256, mtime, size_bytes, indexed_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        ON CONFLICT(id) DO UPDATE SET
-            path=excluded.path,
-            filename=excluded.filename,
-            sha256=excluded.sha256,
-            mtime=excluded.mtime,
-            size_bytes=excluded.size_bytes,
-            indexed_at=excluded.indexed_at;
-        """,
-        (doc_id, path, filename, sha256, mtime, size_bytes, indexed_at),
+        _UPSERT_DOCUMENT_SQL,
+        (doc_id, path, filename, sha256, fingerprint, mtime, size_bytes, indexed_at),
     )
+    _bump_db_version()
+
+
+def update_document_mtime(conn: sqlite3.Connection | sqlite3.Cursor, doc_id: str, mtime: float) -> None:
+    conn.execute("UPDATE documents SET mtime = ? WHERE id = ?;", (mtime, doc_id))
+    _bump_db_version()
 
 
-def get_document_by_path(conn: sqlite3.Connection, path: str) -> dict[str, Any] | None:
+def get_document_by_path(conn: sqlite3.Connection | sqlite3.Cursor, path: str) -> dict[str, Any] | None:
     row = conn.execute(
         "SELECT * FROM documents WHERE path = ? LIMIT 1;",
         (path,),
@@ -308,36 +284,23 @@ def get_document_by_path(conn: sqlite3.Connection, path: str) -> dict[str, Any]
     return dict(row) if row else None
 
 
-def delete_document_chunks(conn: sqlite3.Connection, doc_id: str) -> None:
-    # Remove from chunks and FTS
-    conn.execute("DELETE FROM chunks WHERE document_id = ?;", (doc_id,))
-    conn.execute("DELETE FROM chunks_fts WHERE document_id = ?;", (doc_id,))
-
-
 def insert_chunks(
-    conn: sqlite3.Connection,
+    conn: sqlite3.Connection | sqlite3.Cursor,
     chunk_rows: Iterable[tuple[str, str, int, int, str]],
 ) -> None:
-    conn.executemany(
-        """
-        INSERT INTO chunks (id, document_id, page_start, page_end, text)
-        VALUES (?, ?, ?, ?, ?);
-        """,
-        chunk_rows,
-    )
+    conn.executemany(_INSERT_CHUNK_SQL, chunk_rows)
+    _bump_db_version()
 
 
-def insert_fts_rows(
-    conn: sqlite3.Connection,
-    fts_rows: Iterable[tuple[str, str, str, str, int, int, str]],
-) -> None:
-    conn.executemany(
-        """
-        INSERT INTO chunks_fts (chunk_id, document_id, filename, path, page_start, page_end, text)
-        VALUES (?, ?, ?, ?, ?, ?, ?);
-        """,
-        fts_rows,
-    )
+def merge_fts(conn: sqlite3.Connection, pages: int = 1000) -> None:
+    # automerge is off, so segments written during a batch pile up until
+    # merged here. Each call writes up to `pages` pages; stop once a call
+    # finds nothing left to merge (total_changes moves by < 2).
+    while True:
+        before = conn.total_changes
+        conn.execute("INSERT INTO chunks_fts (chunks_fts, rank) VALUES ('merge', ?);", (pages,))
+        if conn.total_changes - before < 2:
+            break
 
 
 def list_documents(conn: sqlite3.Connection, limit: int = 200) -> list[dict[str, Any]]:
@@ -359,21 +322,50 @@ def search_chunks(
     top_k: int,
     snippet_chars: int,
 ) -> list[SearchResult]:
-    # Use bm25() ranking from FTS5.
-    # We also generate a snippet using snippet() function for readability.
+    with _query_cache_lock:
+        key = (_db_version, query, top_k, snippet_chars)
+        cached = _query_cache.get(key)
+        if cached is not None:
+            _query_cache.move_to_end(key)
+            return list(cached)
+
+    results = _search_chunks_uncached(conn, query, top_k, snippet_chars)
+
+    with _query_cache_lock:
+        _query_cache[key] = results
+        _query_cache.move_to_end(key)
+        while len(_query_cache) > QUERY_CACHE_SIZE:
+            _query_cache.popitem(last=False)
+    return list(results)
+
+
+def _search_chunks_uncached(
+    conn: sqlite3.Connection,
+    query: str,
+    top_k: int,
+    snippet_chars: int,
+) -> list[SearchResult]:
+    # Rank by FTS5's built-in rank column (bm25 by default). FTS5 still scores
+    # and sorts every match internally, so this is no cheaper than bm25();
+    # the saving is that rows come out of FTS5 already in rank order, so
+    # snippet() and the joins to chunks/documents (metadata via the FTS rowid)
+    # only run for the top_k rows LIMIT keeps. Ordering by any other
+    # expression would make SQLite join and snippet every match before sorting.
     rows = conn.execute(
         """
         SELECT
-            document_id,
-            filename,
-            path,
-            page_start,
-            page_end,
-            bm25(chunks_fts) AS score,
-            snippet(chunks_fts, 6, '[', ']', '…', ?) AS snippet
+            c.document_id,
+            d.filename,
+            d.path,
+            c.page_start,
+            c.page_end,
+            chunks_fts.rank AS score,
+            snippet(chunks_fts, 0, '[', ']', '…', ?) AS snippet
         FROM chunks_fts
+        JOIN chunks c ON c.id_rowid = chunks_fts.rowid
+        JOIN documents d ON d.id = c.document_id
         WHERE chunks_fts MATCH ?
-        ORDER BY score
+        ORDER BY chunks_fts.rank
         LIMIT ?;
         """,
         (max(10, snippet_chars), query, top_k),
@@ -1,14 +1,24 @@
 from __future__ import annotations
 
+import hashlib
 import time
-import uuid
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Iterable, List, Tuple
 
 import fitz  # PyMuPDF
 
-from utils import normalize_text, sha256_file, stable_doc_id
+from utils import normalize_pages, quick_fingerprint, sha256_file, stable_doc_id
+
+# get_text("text") defaults, plus dehyphenation, minus PRESERVE_LIGATURES:
+# ligatures are expanded ("ﬁ" -> "fi") so they match typed queries, and
+# unmapped glyphs still come out as their CID rather than U+FFFD.
+_TEXT_FLAGS = (
+    fitz.TEXT_DEHYPHENATE
+    | fitz.TEXT_PRESERVE_WHITESPACE
+    | fitz.TEXT_MEDIABOX_CLIP
+    | fitz.TEXT_CID_FOR_UNKNOWN_UNICODE
+)
 
 
 @dataclass(frozen=True)
@@ -26,6 +36,7 @@ class IndexedDocument:
     path: str
     filename: str
     sha256: str
+    fingerprint: str
     mtime: float
     size_bytes: int
     indexed_at: float
@@ -33,81 +44,103 @@ class IndexedDocument:
 
 
 def extract_pages_text(pdf_path: Path) -> list[str]:
+    # Pages are normalised together in one pass once extraction is done.
     doc = fitz.open(str(pdf_path))
     pages: list[str] = []
     try:
-        for i in range(doc.page_count):
-            page = doc.load_page(i)
-            # "text" uses internal layout. Good default for born-digital PDFs.
-            txt = page.get_text("text") or ""
-            pages.append(normalize_text(txt))
+        for page in doc:
+            # Plain text in internal layout order. Good default for born-digital PDFs.
+            pages.append(page.get_textpage(flags=_TEXT_FLAGS).extractText() or "")
     finally:
         doc.close()
-    return pages
+    return normalize_pages(pages)
 
 
-def build_chunks(
-    pages_text: list[str],
+def _plan_chunks(
+    page_lens: list[int],
     *,
-    doc_id: str,
     max_chunk_chars: int,
     min_chunk_chars: int,
     max_pages_per_chunk: int,
-) -> list[Chunk]:
-    chunks: list[Chunk] = []
+) -> list[tuple[int, int]]:
+    """
+    Decide chunk boundaries from page lengths alone.
 
-    buf: list[str] = []
-    page_start = 1
-    current_start = 1
-    current_end = 1
-
-    def flush():
-        nonlocal buf, current_start, current_end
-        if not buf:
-            return
-        text = normalize_text("\n".join(buf))
-        if text:
-            chunks.append(
-                Chunk(
-                    id=uuid.uuid4().hex,
-                    doc_id=doc_id,
-                    page_start=current_start,
-                    page_end=current_end,
-                    text=text,
-                )
-            )
-        buf = []
+    Pages with length 0 are skipped. Returns inclusive (first, last) page
+    indexes into page_lens; no strings are built here.
+    """
+    cuts: list[tuple[int, int]] = []
 
-    for idx, text in enumerate(pages_text, start=1):
+    # current_len is the length of the chunk's pages joined with "\n".
+    start = end = -1
+    current_len = 0
+
+    for idx, n in enumerate(page_lens):
         # Skip empty pages but keep page progression by ending chunks properly.
-        if not text:
+        if not n:
             continue
 
-        if not buf:
-            current_start = idx
-            current_end = idx
-            buf = [text]
+        if start < 0:
+            start = end = idx
+            current_len = n
             continue
 
-        candidate = "\n".join(buf + [text])
-        pages_in_chunk = (idx - current_start) + 1
+        candidate_len = current_len + 1 + n
+        pages_in_chunk = (idx - start) + 1
 
-        if len(candidate) <= max_chunk_chars and pages_in_chunk <= max_pages_per_chunk:
-            buf.append(text)
-            current_end = idx
+        if candidate_len <= max_chunk_chars and pages_in_chunk <= max_pages_per_chunk:
+            end = idx
+            current_len = candidate_len
         else:
             # Ensure we don't create tiny chunks when avoidable:
             # if current chunk is too small and we can append at least one page, do so.
-            if len("\n".join(buf)) < min_chunk_chars and pages_in_chunk <= max_pages_per_chunk:
-                buf.append(text)
-                current_end = idx
-            flush()
+            if current_len < min_chunk_chars and pages_in_chunk <= max_pages_per_chunk:
+                end = idx
+            cuts.append((start, end))
             # Start new chunk with this page
-            current_start = idx
-            current_end = idx
-            buf = [text]
+            start = end = idx
+            current_len = n
+
+    if start >= 0:
+        cuts.append((start, end))
+    return cuts
+
 
-    flush()
+def build_chunks(
+    pages_text: list[str],
+    *,
+    doc_id: str,
+    max_chunk_chars: int,
+    min_chunk_chars: int,
+    max_pages_per_chunk: int,
+) -> list[Chunk]:
+    # pages_text is already normalised (see extract_pages_text): no runs of
+    # whitespace and nothing to strip, so blank pages are simply "".
+    page_lens = [len(t) for t in pages_text]
+    cuts = _plan_chunks(
+        page_lens,
+        max_chunk_chars=max_chunk_chars,
+        min_chunk_chars=min_chunk_chars,
+        max_pages_per_chunk=max_pages_per_chunk,
+    )
+
+    chunks: list[Chunk] = []
+    for first, last in cuts:
+        # One join per chunk, over the non-blank pages in its range. Joining
+        # normalised pages with " " is already normalised.
+        text = " ".join(pages_text[i] for i in range(first, last + 1) if page_lens[i])
+        page_start, page_end = first + 1, last + 1
+        # Deterministic ID: reindexing the same content yields the same IDs.
+        key = f"{doc_id}:{page_start}:{page_end}:{len(chunks)}"
+        chunks.append(
+            Chunk(
+                id=hashlib.blake2b(key.encode(), digest_size=16).hexdigest(),
+                doc_id=doc_id,
+                page_start=page_start,
+                page_end=page_end,
+                text=text,
+            )
+        )
     return chunks
 
 
@@ -136,6 +169,7 @@ def index_pdf(
         path=str(pdf_path.resolve()),
         filename=pdf_path.name,
         sha256=sha256,
+        fingerprint=quick_fingerprint(pdf_path),
         mtime=float(stat.st_mtime),
         size_bytes=int(stat.st_size),
         indexed_at=time.time(),
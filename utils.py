@@ -1,13 +1,34 @@
 from __future__ import annotations
 
 import hashlib
+import mmap
+import os
+import re
 from pathlib import Path
 from typing import Iterable
 
+_WS_RE = re.compile(r"[\s\u00a0]+")
+
+# Joins pages for normalize_pages; not whitespace, so the regex leaves it be.
+_PAGE_SENTINEL = "\x00\x00PAGE\x00\x00"
+
 
 def sha256_file(path: Path, chunk_size: int = 1024 * 1024) -> str:
-    h = hashlib.sha256()
     with path.open("rb") as f:
+        # Python 3.11+: hash the fd entirely in C.
+        if hasattr(hashlib, "file_digest"):
+            return hashlib.file_digest(f, "sha256").hexdigest()
+
+        # Older Pythons: hand OpenSSL the whole file in one update() call.
+        h = hashlib.sha256()
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                h.update(mm)
+            return h.hexdigest()
+        except (ValueError, OSError):
+            # Empty files (and some filesystems) cannot be mapped.
+            pass
+
         while True:
             b = f.read(chunk_size)
             if not b:
@@ -16,6 +37,21 @@ def sha256_file(path: Path, chunk_size: int = 1024 * 1024) -> str:
     return h.hexdigest()
 
 
+def quick_fingerprint(path: Path, edge_size: int = 64 * 1024) -> str:
+    # Cheap change check: size + first and last 64 KiB. Catches appended
+    # (incremental) PDF updates and most edits without reading the whole file.
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        size = f.seek(0, 2)
+        h.update(str(size).encode())
+        f.seek(0)
+        h.update(f.read(edge_size))
+        if size > edge_size:
+            f.seek(max(edge_size, size - edge_size))
+            h.update(f.read(edge_size))
+    return h.hexdigest()
+
+
 def stable_doc_id(sha256_hex: str) -> str:
     # A deterministic ID derived from content. Helps with versioning.
     # If the content changes, the ID changes.
@@ -24,9 +60,17 @@ def stable_doc_id(sha256_hex: str) -> str:
 
 def normalize_text(s: str) -> str:
     # Light normalisation: collapse whitespace, preserve readability.
-    s = s.replace("\u00a0", " ")
-    s = " ".join(s.split())
-    return s.strip()
+    return _WS_RE.sub(" ", s).strip()
+
+
+def normalize_pages(pages: list[str]) -> list[str]:
+    # normalize_text for every page of a document in a single regex pass.
+    joined = _PAGE_SENTINEL.join(pages)
+    out = [p.strip() for p in _WS_RE.sub(" ", joined).split(_PAGE_SENTINEL)]
+    if len(out) != len(pages):
+        # The sentinel occurs in the text itself; normalise page by page.
+        return [normalize_text(p) for p in pages]
+    return out
 
 
 def iter_pdf_paths(root: Path, recursive: bool = True) -> Iterable[Path]:
@@ -38,7 +82,19 @@ def iter_pdf_paths(root: Path, recursive: bool = True) -> Iterable[Path]:
     if not root.exists():
         return
 
-    pattern = "**/*.pdf" if recursive else "*.pdf"
-    for p in root.glob(pattern):
-        if p.is_file() and p.suffix.lower() == ".pdf":
-            yield p
+    # Walk with os.scandir: DirEntry caches the type from the directory read,
+    # so non-PDF entries cost no stat() and no Path allocation.
+    stack = [str(root)]
+    while stack:
+        d = stack.pop()
+        try:
+            with os.scandir(d) as it:
+                for e in it:
+                    if e.is_dir(follow_symlinks=False):
+                        if recursive:
+                            stack.append(e.path)
+                    elif e.name.endswith((".pdf", ".PDF")) and e.is_file():
+                        yield Path(e.path)
+        except OSError:
+            # Unreadable directory; skip it like glob() would.
+            continue